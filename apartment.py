@@ -23,15 +23,19 @@ Notes and assumptions:
         * As we don't have a crystal ball, we can't predict the future interest rates.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional
 
-from mortgage import Loan
+import numpy as np
+from numba import njit, prange
 
-SELL_EXPENSES_PERCENTAGE = 0.025 * 1.18  # 2.5% of the sell price (+VAT)
+from rates import monthly_from_annual
 
+SELL_EXPENSES_PERCENTAGE = 0.0295  # 2.5% of the sell price (+18% VAT)
 
-@dataclass
+
+@dataclass(slots=True)
 class Assumptions:
     investment_term: int
     annual_apartment_price_growth: float
@@ -46,32 +50,60 @@ class Assumptions:
         return sell_price * SELL_EXPENSES_PERCENTAGE
 
 
-@dataclass
+# The amortization helpers accept scalars or (broadcastable) arrays, to be shared with the batch estimation
+def _monthly_payment(principal, annual_interest, term):
+    monthly_interest = np.asarray(annual_interest, dtype=np.float64) / 12
+    months = np.multiply(term, 12)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        payment = principal * monthly_interest / (1 - (1 + monthly_interest) ** -months)
+    return np.where(monthly_interest == 0, principal / months, payment)
+
+
+def _balance_after(principal, annual_interest, term, months):
+    monthly_interest = np.asarray(annual_interest, dtype=np.float64) / 12
+    payment = _monthly_payment(principal, annual_interest, term)
+    # The loan is paid off after its term, so the balance stays 0 (and the formula would keep amortizing)
+    paid_off = np.greater_equal(months, np.multiply(term, 12))
+    growth = (1 + monthly_interest) ** months
+    with np.errstate(divide="ignore", invalid="ignore"):
+        balance = principal * growth - payment * (growth - 1) / monthly_interest
+    balance = np.where(monthly_interest == 0, principal - payment * months, balance)
+    return np.where(paid_off, 0.0, balance)
+
+
+@lru_cache(maxsize=4096)
+def _loan_summary(principal: float, interest: float, term: int, months: int) -> tuple[float, float, float]:
+    """Return the (monthly payment, balance, total interest paid) of a loan after the given number of months."""
+    months = min(months, term * 12)  # No payments after the loan is paid off
+    payment = float(_monthly_payment(principal, interest, term))
+    balance = float(_balance_after(principal, interest, term, months))
+    return payment, balance, payment * months - (principal - balance)
+
+
+@dataclass(frozen=True, slots=True)
 class Mortgage:
     apartment_buy_price: float
     apartment_assessor_price_evaluation: float
     financing_percentage: float  # for example, 0.75 for 75%
     interest_rate: float  # annual interest rate (for example, 0.03 for 3%)
     loan_term: int  # number of years
+    loan_amount: float = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        self.loan = Loan(
-            principal=self.loan_amount,
-            interest=self.interest_rate,
-            term=self.loan_term,
-            currency="₪",
-        )
-
-    @property
-    def loan_amount(self) -> float:
-        return min(self.apartment_buy_price, self.apartment_assessor_price_evaluation) * self.financing_percentage
+        # Computed once, as the loan amount is read on every mortgage calculation (the dataclass is frozen)
+        lowest_price = min(self.apartment_buy_price, self.apartment_assessor_price_evaluation)
+        object.__setattr__(self, "loan_amount", lowest_price * self.financing_percentage)
 
     @property
     def monthly_payment(self) -> float:
-        return float(self.loan.monthly_payment)
+        return self.summary(self.loan_term * 12)[0]
+
+    def summary(self, months: int) -> tuple[float, float, float]:
+        """Return the (monthly payment, balance, total interest paid) after the given number of months."""
+        return _loan_summary(self.loan_amount, self.interest_rate, self.loan_term, months)
 
 
-@dataclass
+@dataclass(slots=True)
 class ApartmentInvestmentSummary:
     initial_capital: float
     final_capital: float
@@ -85,7 +117,10 @@ class ApartmentInvestmentSummary:
 
     @property
     def avg_annual_return(self) -> float:
-        return (self.final_capital / self.initial_capital) ** (1 / self.investment_term) - 1
+        capital_ratio = self.final_capital / self.initial_capital
+        if capital_ratio < 0:
+            return float("nan")  # No real annual return when losing more than the initial capital
+        return capital_ratio ** (1.0 / self.investment_term) - 1.0
 
     def __str__(self):
         return (
@@ -101,46 +136,70 @@ class ApartmentInvestmentSummary:
         )
 
 
-def monthly_cashflows(investment_term: int, mortgage: Mortgage, assumptions: Assumptions) -> list[float]:
-    cashflows = []
+def yearly_cashflows(
+    investment_term: int, mortgage: Mortgage, assumptions: Assumptions, growth_1p: Optional[float] = None
+) -> np.ndarray:
+    # The monthly cashflow of each year (it is constant within a year)
+    if growth_1p is None:
+        growth_1p = 1 + assumptions.annual_apartment_price_growth
+    delta = assumptions.rent_increase_delta
+    rent_growth_step = growth_1p**delta
     rent_per_month = (mortgage.apartment_assessor_price_evaluation * assumptions.annual_rent_percentage) / 12
-    for year in range(1, investment_term + 1):
-        cashflows += [rent_per_month - mortgage.monthly_payment] * 12
-        if year % assumptions.rent_increase_delta == 0:
-            rent_per_month *= (1 + assumptions.annual_apartment_price_growth) ** assumptions.rent_increase_delta
+    years = np.arange(investment_term)
+    rents = rent_per_month * np.power(rent_growth_step, years // delta)
+    # The mortgage is paid only until the end of the loan term
+    return rents - np.where(years < mortgage.loan_term, mortgage.monthly_payment, 0.0)
+
 
-    return cashflows
+def monthly_cashflows(
+    investment_term: int, mortgage: Mortgage, assumptions: Assumptions, growth_1p: Optional[float] = None
+) -> np.ndarray:
+    return np.repeat(yearly_cashflows(investment_term, mortgage, assumptions, growth_1p), 12)
+
+
+def _compound_cashflows(yearly_cashflows: np.ndarray, market_monthly_factor: float) -> tuple[float, float]:
+    """
+    Return the (missed gains, gains) from investing each monthly cashflow in the market until the end of the term.
+
+    With f being the monthly market factor, a cashflow of month i (out of N) grows by f^(N - i), so the result is a
+    dot product of the cashflows with these growth factors. As the cashflows are constant within a year, each year is
+    collapsed into a single weight using the geometric sum of its 12 months.
+    """
+    if market_monthly_factor == 1:
+        year_weight = 12.0
+    else:
+        year_weight = market_monthly_factor * (market_monthly_factor**12 - 1) / (market_monthly_factor - 1)
+    years_left = np.arange(len(yearly_cashflows) - 1, -1, -1)
+    weights = year_weight * np.power(market_monthly_factor, 12 * years_left)
+    market_capital_missed_gains = np.dot(np.maximum(-yearly_cashflows, 0.0), weights)
+    market_capital_gains = np.dot(np.maximum(yearly_cashflows, 0.0), weights)
+    return float(market_capital_missed_gains), float(market_capital_gains)
 
 
 def investment_estimation(
     mortgage: Mortgage,
     assumptions: Assumptions,
 ) -> ApartmentInvestmentSummary:
+    # The apartment price growth drives both the sell price and the rent increases
+    growth_1p = 1 + assumptions.annual_apartment_price_growth
     apartment_sell_price = (assumptions.new_apartment_current_value or mortgage.apartment_buy_price) * (
-        (1 + assumptions.annual_apartment_price_growth) ** assumptions.investment_term
+        growth_1p**assumptions.investment_term
     )
 
     # Calculate the loss (or gain) from not investing the (probably negative) cashflows in the market each month
-    cashflows = monthly_cashflows(assumptions.investment_term, mortgage, assumptions)
-    market_monthly_return = (1 + assumptions.annual_market_return) ** (1 / 12) - 1
-    market_capital_missed_gains = 0
-    market_capital_gains = 0
-    for cashflow in cashflows:
-        if cashflow < 0:
-            market_capital_missed_gains -= cashflow
-        else:
-            market_capital_gains += cashflow
-        market_capital_gains *= 1 + market_monthly_return
-        market_capital_missed_gains *= 1 + market_monthly_return
+    cashflows = yearly_cashflows(assumptions.investment_term, mortgage, assumptions, growth_1p)
+    market_monthly_return = monthly_from_annual(assumptions.annual_market_return)
+    market_factor = 1 + market_monthly_return
+    market_capital_missed_gains, market_capital_gains = _compound_cashflows(cashflows, market_factor)
     total_loss_from_cashflows = market_capital_missed_gains - market_capital_gains
 
     # Calculate the profit from the apartment investment
     initial_invested_capital = assumptions.buy_expenses + (mortgage.apartment_buy_price - mortgage.loan_amount)
-    mortgage_end_state = mortgage.loan.schedule(assumptions.investment_term * 12)
+    _, mortgage_balance, mortgage_total_interest = mortgage.summary(assumptions.investment_term * 12)
     final_capital = (
         apartment_sell_price
         - assumptions.calc_sell_expenses(apartment_sell_price)
-        - float(mortgage_end_state.balance)
+        - mortgage_balance
         - total_loss_from_cashflows
     )
     ret = ApartmentInvestmentSummary(
@@ -149,13 +208,94 @@ def investment_estimation(
         investment_term=assumptions.investment_term,
         buy_price=mortgage.apartment_buy_price,
         sell_price=apartment_sell_price,
-        interest_paid_on_mortgage=float(mortgage_end_state.total_interest),
-        monthly_distinct_cashflows=sorted(set(cashflows)),
+        interest_paid_on_mortgage=mortgage_total_interest,
+        monthly_distinct_cashflows=np.unique(cashflows).tolist(),
         total_loss_from_cashflows=total_loss_from_cashflows,
     )
     return ret
 
 
+@njit(cache=True, parallel=True)
+def _sweep(
+    initial_capital: np.ndarray,
+    sell_price_after_expenses: np.ndarray,
+    mortgage_balance: np.ndarray,
+    rent_per_month: np.ndarray,
+    rent_growth_step: np.ndarray,
+    monthly_payment: np.ndarray,
+    market_monthly_factor: np.ndarray,
+    loan_term: np.ndarray,
+    investment_term: np.ndarray,
+    rent_increase_delta: int,
+    out: np.ndarray,
+):
+    # Same math as `_compound_cashflows`, one scenario (flattened index) per iteration across the CPU cores
+    for i in prange(out.size):
+        f = market_monthly_factor[i]
+        year_weight = 12.0 if f == 1 else f * (f**12 - 1) / (f - 1)
+        term = investment_term[i]
+        # The missed gains minus the gains is the (negated) sum of the compounded cashflows
+        total_loss_from_cashflows = 0.0
+        for year in range(term):
+            cashflow = rent_per_month[i] * rent_growth_step[i] ** (year // rent_increase_delta)
+            if year < loan_term[i]:
+                cashflow -= monthly_payment[i]
+            total_loss_from_cashflows -= cashflow * year_weight * f ** (12 * (term - 1 - year))
+        final_capital = sell_price_after_expenses[i] - mortgage_balance[i] - total_loss_from_cashflows
+        capital_ratio = final_capital / initial_capital[i]
+        # Same as `ApartmentInvestmentSummary.avg_annual_return`
+        out[i] = np.nan if capital_ratio < 0 else capital_ratio ** (1 / term) - 1
+
+
+def investment_estimation_batch(
+    apartment_buy_price,
+    interest_rate,
+    financing_percentage,
+    annual_apartment_price_growth,
+    annual_rent_percentage,
+    annual_market_return,
+    investment_term,
+    loan_term,
+    buy_expenses,
+    rent_increase_delta: int = 1,
+    apartment_assessor_price_evaluation=None,
+) -> np.ndarray:
+    """
+    Vectorized version of `investment_estimation` for sensitivity analyses, returning the average annual returns.
+
+    All the arguments are scalars or arrays that broadcast together (one element per scenario). The assessor price
+    defaults to the buy price, and there is no Pinuy-Binuy value (the apartment is sold based on its buy price).
+    """
+    apartment_buy_price = np.asarray(apartment_buy_price, dtype=np.float64)
+    if apartment_assessor_price_evaluation is None:
+        apartment_assessor_price_evaluation = apartment_buy_price
+    investment_term = np.asarray(investment_term, dtype=np.int64)
+    growth_1p = 1 + np.asarray(annual_apartment_price_growth, dtype=np.float64)
+    apartment_sell_price = apartment_buy_price * np.power(growth_1p, investment_term)
+
+    # The closed-form parts are computed for all the scenarios at once, and the per-year cashflows in `_sweep`
+    loan_amount = np.minimum(apartment_buy_price, apartment_assessor_price_evaluation) * financing_percentage
+    scenarios = np.broadcast_arrays(
+        buy_expenses + (apartment_buy_price - loan_amount),
+        apartment_sell_price * (1 - SELL_EXPENSES_PERCENTAGE),
+        _balance_after(loan_amount, interest_rate, loan_term, investment_term * 12),
+        (apartment_assessor_price_evaluation * np.asarray(annual_rent_percentage)) / 12,
+        growth_1p**rent_increase_delta,
+        _monthly_payment(loan_amount, interest_rate, loan_term),
+        (1 + np.asarray(annual_market_return, dtype=np.float64)) ** (1 / 12),
+        loan_term,
+        investment_term,
+    )
+    out = np.empty(scenarios[0].shape)
+    _sweep(
+        *(np.ascontiguousarray(scenario, dtype=np.float64).ravel() for scenario in scenarios[:-2]),
+        *(np.ascontiguousarray(scenario, dtype=np.int64).ravel() for scenario in scenarios[-2:]),
+        rent_increase_delta,
+        out.reshape(-1),
+    )
+    return out
+
+
 def main():
     estimation = investment_estimation(
         mortgage=Mortgage(
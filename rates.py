@@ -0,0 +1,11 @@
+"""
+Interest rate conversions shared by the investment scripts.
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def monthly_from_annual(annual_rate: float) -> float:
+    # Sweeps usually repeat a small set of rates, so the compounded monthly rate is computed once per rate
+    return (1.0 + annual_rate) ** (1.0 / 12.0) - 1.0
@@ -3,6 +3,9 @@ from typing import Optional
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from numba import njit, prange
+
+from rates import monthly_from_annual
 
 # Assuming monthly_closing_prices is available (this is the monthly price data)
 INITIAL_CAPITAL = 1_000_000
@@ -10,46 +13,57 @@ INITIAL_CAPITAL = 1_000_000
 # Parameters
 INVESTMENT_PERIODS = [2, 5, 10, 25]  # Years
 
-def get_monthly_closing_prices() -> list[float]:
-    snp500_prices = pd.read_csv('SPX.csv')
-
-    # Convert the 'Date' column to datetime
-    snp500_prices['Date'] = pd.to_datetime(snp500_prices['Date'])
-
-    # Set the 'Date' column as index (optional, but useful for grouping)
-    snp500_prices.set_index('Date', inplace=True)
+def get_monthly_closing_prices() -> np.ndarray:
+    # Read only the needed columns, with the 'Date' column parsed as the index (useful for grouping)
+    snp500_prices = pd.read_csv('SPX.csv', usecols=['Date', 'Close'], parse_dates=['Date'], index_col='Date')
 
     # Group by year and month, and take the last closing price of each month
-    monthly_closing_prices = snp500_prices['Close'].resample('M').last()
+    return snp500_prices['Close'].resample('ME').last().to_numpy(dtype=np.float64)
 
-    # Return the list of monthly closing prices
-    return monthly_closing_prices.tolist()
-def lump_sum_return(prices, start_idx: int, investment_period: int):
-    start_price = prices[start_idx]
-    end_price = prices[start_idx + investment_period - 1]
-    return (end_price - start_price) / start_price
 
+def lump_sum_returns(prices: np.ndarray, investment_period: int) -> np.ndarray:
+    # Returns of investing at every start index (the last price is never used as a start)
+    start_prices = prices[:len(prices) - investment_period]
+    end_prices = prices[investment_period - 1:len(prices) - 1]
+    return (end_prices - start_prices) / start_prices
 
-def get_dca_return_calculator(buying_period: Optional[int] = None, money_market_fund_annual_interest: float = 0.03):
-    def calculator(prices: list[float], start_idx: int, investment_period: int):
-        local_buying_period = buying_period if buying_period is not None else investment_period
-        num_shares = 0
-        money_market_fund_balance = INITIAL_CAPITAL
-        monthly_fund_interest_rate = (1 + money_market_fund_annual_interest) ** (1 / 12) - 1
+
+@njit(cache=True, parallel=True, fastmath=True)
+def dca_returns(
+    prices: np.ndarray, investment_period: int, buying_period: int, monthly_fund_factor: float
+) -> np.ndarray:
+    # Returns of the DCA strategy for every start index (same start indices as lump_sum_returns)
+    returns = np.empty(len(prices) - investment_period)
+    for start_idx in prange(len(prices) - investment_period):
+        num_shares = 0.0
+        money_market_fund_balance = float(INITIAL_CAPITAL)
         # Buy stocks each month in the buying period:
-        for i in range(local_buying_period):
-            money_market_fund_balance *= 1 + monthly_fund_interest_rate
-            invest_this_month = money_market_fund_balance / (local_buying_period - i)
+        for i in range(buying_period):
+            money_market_fund_balance *= monthly_fund_factor
+            invest_this_month = money_market_fund_balance / (buying_period - i)
             # Withdraw from the fund and invest in the stock
             money_market_fund_balance -= invest_this_month
             num_shares += invest_this_month / prices[start_idx + i]
         money_at_the_end = num_shares * prices[start_idx + investment_period - 1]
-        return (money_at_the_end - INITIAL_CAPITAL) / INITIAL_CAPITAL
-    return calculator
+        returns[start_idx] = (money_at_the_end - INITIAL_CAPITAL) / INITIAL_CAPITAL
+    return returns
+
+
+def get_dca_return_calculator(buying_period: Optional[int] = None, money_market_fund_annual_interest: float = 0.03):
+    # The fund interest doesn't depend on the prices or the period, so compute it once for all calls
+    monthly_fund_interest_rate = monthly_from_annual(money_market_fund_annual_interest)
+    monthly_fund_factor = 1 + monthly_fund_interest_rate
 
+    def calculator(prices: np.ndarray, investment_period: int) -> np.ndarray:
+        local_buying_period = buying_period if buying_period is not None else investment_period
+        # The compiled kernel doesn't check bounds, so buying after the investment period would read past the prices
+        if local_buying_period > investment_period:
+            raise ValueError(
+                f"Buying period ({local_buying_period}) is longer than the investment period ({investment_period})"
+            )
+        return dca_returns(prices, investment_period, local_buying_period, monthly_fund_factor)
+    return calculator
 
-def get_y_axis(calc_func, prices, investment_period):
-    return [calc_func(prices, i, investment_period) * 100 for i in range(len(prices) - investment_period)]
 
 def main():
     prices = get_monthly_closing_prices()
@@ -59,14 +73,14 @@ def main():
 
     dca_return = get_dca_return_calculator(buying_period=12, money_market_fund_annual_interest=0.03)   # in the future test also shorter buying periods
     for idx, years in enumerate(INVESTMENT_PERIODS):
-        returns_lump_sum = get_y_axis(lump_sum_return, prices, investment_period=years * 12)
-        returns_dca = get_y_axis(dca_return, prices, investment_period=years * 12)
+        returns_lump_sum = lump_sum_returns(prices, investment_period=years * 12) * 100
+        returns_dca = dca_return(prices, investment_period=years * 12) * 100
 
         # Calculate and display the mean and standard deviation
-        lump_sum_mean = np.mean(returns_lump_sum)
-        lump_sum_std = np.std(returns_lump_sum)
-        dca_mean = np.mean(returns_dca)
-        dca_std = np.std(returns_dca)
+        lump_sum_mean = returns_lump_sum.mean()
+        lump_sum_std = returns_lump_sum.std()
+        dca_mean = returns_dca.mean()
+        dca_std = returns_dca.std()
 
         # Add text with mean and std
         axes[idx].text(0.05, 0.95, f"Lump-Sum:\nMean: {lump_sum_mean:.4}\nStd: {lump_sum_std:0.4}",
@@ -75,11 +89,11 @@ def main():
                        transform=axes[idx].transAxes, fontsize=10, verticalalignment='top', color='blue')
 
         # Plot the returns
-        years_axis = [1927 + i // 12 for i in range(len(prices) - years * 12)]
+        years_axis = 1927 + np.arange(len(prices) - years * 12) // 12
 
-        # Plot the returns with smaller dots
-        axes[idx].plot(years_axis, returns_lump_sum, "o-", color="orange", markersize=3, label="Lump-Sum")
-        axes[idx].plot(years_axis, returns_dca, "o-", color="blue", markersize=3, label="DCA")
+        # Plot the returns as lines only - drawing a marker per month is slow for the long series
+        axes[idx].plot(years_axis, returns_lump_sum, "-", color="orange", linewidth=0.5, label="Lump-Sum")
+        axes[idx].plot(years_axis, returns_dca, "-", color="blue", linewidth=0.5, label="DCA")
 
         axes[idx].set_title(f"{years} Year Investment Period", fontsize=14)
         axes[idx].set_xlabel("Year", fontsize=12)